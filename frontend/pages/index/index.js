@@ -192,7 +192,7 @@ Page({
     ctx.takePhoto({
       quality: 'low',
       success: (res) => {
-        this.processEmotionDetectionOnce(res.tempImagePath);
+        this.processEmotionDetectionOnce(res.tempImagePath, Date.now());
       },
       fail: (error) => {
         console.log('拍照失败:', error);
@@ -203,30 +203,40 @@ Page({
   },
 
   // 处理单次情绪检测
-  async processEmotionDetectionOnce(imagePath) {
+  async processEmotionDetectionOnce(imagePath, capturedAt) {
     // 先压缩，优先使用上传文件接口，失败再回退 base64
     wx.compressImage({
       src: imagePath,
       quality: 40,
       success: (cres) => {
         const compressedPath = cres.tempFilePath || imagePath;
-        this.detectEmotionUploadFile(compressedPath);
+        this.detectEmotionUploadFile(compressedPath, capturedAt);
       },
       fail: () => {
-        this.detectEmotionUploadFile(imagePath);
+        this.detectEmotionUploadFile(imagePath, capturedAt);
       }
     });
   },
 
+  // 服务端准入控制拒绝（过期/限流/繁忙），本帧直接放弃，不再回退重试
+  isDetectionShed(statusCode) {
+    const shed = statusCode === 408 || statusCode === 429 || statusCode === 503;
+    if (shed) {
+      console.log('情绪检测被服务端丢弃，状态码:', statusCode);
+    }
+    return shed;
+  },
+
   // 使用上传文件接口调用后端API（multipart/form-data）
-  detectEmotionUploadFile(filePath) {
+  detectEmotionUploadFile(filePath, capturedAt) {
     const userId = this.getOrCreateUserId();
     wx.uploadFile({
       url: app.globalData.serverUrl + '/api/detect-emotion',
       filePath,
       name: 'file',
-      formData: { user_id: userId, mode: this.data.playMode || 'auto' },
+      formData: { user_id: userId, mode: this.data.playMode || 'auto', priority: 'interactive', frame_age_ms: Date.now() - capturedAt },
       success: (res) => {
+        if (this.isDetectionShed(res.statusCode)) return;
         try {
           const data = typeof res.data === 'string' ? JSON.parse(res.data) : res.data;
           if (data && data.success && data.emotion) {
@@ -243,22 +253,22 @@ Page({
           }
         } catch (e) {}
         // 回退到 base64 方案
-        this.readAsBase64AndDetect(filePath);
+        this.readAsBase64AndDetect(filePath, capturedAt);
       },
       fail: () => {
         // 回退到 base64 方案
-        this.readAsBase64AndDetect(filePath);
+        this.readAsBase64AndDetect(filePath, capturedAt);
       }
     });
   },
 
-  readAsBase64AndDetect(filePath) {
+  readAsBase64AndDetect(filePath, capturedAt) {
     wx.getFileSystemManager().readFile({
       filePath,
       encoding: 'base64',
       success: res => {
         const base64Img = 'data:image/jpeg;base64,' + res.data;
-        this.detectEmotionBase64(base64Img);
+        this.detectEmotionBase64(base64Img, capturedAt);
       },
       fail: err => {
         console.log('图片转base64失败:', err);
@@ -268,14 +278,20 @@ Page({
   },
 
   // 用base64图片调用后端API
-  detectEmotionBase64(base64Img) {
+  detectEmotionBase64(base64Img, capturedAt) {
     wx.request({
       url: app.globalData.serverUrl + '/api/detect-emotion',
       method: 'POST',
       header: { 'content-type': 'application/json' },
-      data: { image: base64Img },
+      data: {
+        image: base64Img,
+        user_id: this.getOrCreateUserId(),
+        priority: 'interactive',
+        frame_age_ms: Date.now() - capturedAt
+      },
       timeout: 60000,
       success: (res) => {
+        if (this.isDetectionShed(res.statusCode)) return;
         if (res.statusCode === 200 && res.data && res.data.emotion) {
           this.addEmotionResult(res.data.emotion, res.data.confidence);
           this.setData({
@@ -534,7 +550,7 @@ Page({
     ctx.takePhoto({
       quality: 'low',
       success: (res) => {
-        this.processEmotionDetection(res.tempImagePath);
+        this.processEmotionDetection(res.tempImagePath, Date.now());
       },
       fail: (error) => {
         console.log('拍照失败:', error);
@@ -610,10 +626,10 @@ Page({
   },
 
   // 处理情绪检测
-  async processEmotionDetection(imageData) {
+  async processEmotionDetection(imageData, capturedAt) {
     try {
       // 调用后端API
-      const result = await this.detectEmotion(imageData);
+      const result = await this.detectEmotion(imageData, capturedAt);
       
       this.setData({
         currentEmotion: result.emotion,
@@ -634,9 +650,12 @@ Page({
       this.addAnimation('bounce');
       
     } catch (error) {
-      console.log('情绪检测失败:', error);
-      // 使用测试数据
-      this.useTestEmotion();
+      // 被服务端丢弃的帧已在 isDetectionShed 中记录，直接跳过
+      if (!(error && this.isDetectionShed(error.statusCode))) {
+        console.log('情绪检测失败:', error);
+        // 使用测试数据
+        this.useTestEmotion();
+      }
     }
     
     // 继续检测
@@ -646,8 +665,10 @@ Page({
   },
 
   // 情绪检测API调用
-  detectEmotion(imageData) {
+  detectEmotion(imageData, capturedAt) {
     const userId = this.getOrCreateUserId();
+    // 连续检测为后台优先级，服务端繁忙时优先让位给单次交互检测
+    const params = { user_id: userId, mode: this.data.playMode || 'auto', priority: 'background', frame_age_ms: Date.now() - capturedAt };
     return new Promise((resolve, reject) => {
       // 已是 base64 的场景：data:image/xxx;base64,...
       if (typeof imageData === 'string' && imageData.indexOf('data:image') === 0) {
@@ -655,7 +676,7 @@ Page({
           url: app.globalData.serverUrl + '/api/detect-emotion',
           method: 'POST',
           header: { 'content-type': 'application/json' },
-          data: { image: imageData, user_id: userId, mode: this.data.playMode || 'auto' },
+          data: Object.assign({ image: imageData }, params),
           timeout: 60000,
           success: (res) => res.statusCode === 200 ? resolve(res.data) : reject(res),
           fail: reject
@@ -668,8 +689,9 @@ Page({
         url: app.globalData.serverUrl + '/api/detect-emotion',
         filePath: imageData,
         name: 'file',
-        formData: { user_id: userId, mode: this.data.playMode || 'auto' },
+        formData: params,
         success: (res) => {
+          if (this.isDetectionShed(res.statusCode)) return reject(res);
           try {
             const data = typeof res.data === 'string' ? JSON.parse(res.data) : res.data;
             return data && data.success ? resolve(data) : reject(data || res);
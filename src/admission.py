@@ -0,0 +1,149 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝，携带 HTTP 状态码与建议的 Retry-After 秒数"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """单用户令牌桶"""
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated_at = now
+
+
+class AdmissionController:
+    """情绪识别准入控制：全局在途上限 + 单用户令牌桶 + 图像新鲜度 + 交互优先
+
+    - 在途请求达到 max_inflight 时快速返回 503；后台（连续检测）请求只能使用
+      max_inflight - interactive_reserve 个名额，剩余名额留给单次交互请求。
+    - 交互请求在名额已满时最多等待 interactive_wait_ms，后台请求不等待。
+    - 单用户超过 user_rate/秒（突发 user_burst）时返回 429。
+    - 图像年龄 = 客户端上报的相对年龄 frame_age_ms（拍摄到发送，客户端本地时钟计算）
+      + 服务端自收到请求起的耗时，超过 max_frame_age_ms 时直接丢弃，不依赖两端时钟一致。
+    - 先占名额再扣令牌，因繁忙被拒的请求不消耗令牌。
+    """
+
+    def __init__(self, max_inflight: int = 4, interactive_reserve: int = 1,
+                 user_rate: float = 2.0, user_burst: float = 4.0,
+                 max_frame_age_ms: int = 3000, interactive_wait_ms: int = 200,
+                 max_tracked_users: int = 10000):
+        if user_rate <= 0:
+            raise ValueError(f'DETECT_USER_RATE 必须大于 0，当前为 {user_rate}')
+        self.max_inflight = max_inflight
+        self.interactive_reserve = min(interactive_reserve, max_inflight - 1)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_frame_age_ms = max_frame_age_ms
+        self.interactive_wait_ms = interactive_wait_ms
+        self.max_tracked_users = max_tracked_users
+
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._bucket_lock = threading.Lock()
+        self._counters = {'admitted': 0, 'rejected_busy': 0, 'rejected_rate': 0, 'dropped_stale': 0}
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionController':
+        return cls(
+            max_inflight=int(os.environ.get('DETECT_MAX_INFLIGHT', 4)),
+            interactive_reserve=int(os.environ.get('DETECT_INTERACTIVE_RESERVE', 1)),
+            user_rate=float(os.environ.get('DETECT_USER_RATE', 2.0)),
+            user_burst=float(os.environ.get('DETECT_USER_BURST', 4.0)),
+            max_frame_age_ms=int(os.environ.get('DETECT_MAX_FRAME_AGE_MS', 3000)),
+            interactive_wait_ms=int(os.environ.get('DETECT_INTERACTIVE_WAIT_MS', 200))
+        )
+
+    def _take_token(self, user_id: str):
+        """从用户令牌桶取一个令牌，不足时抛出 429"""
+        now = time.monotonic()
+        with self._bucket_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_burst, now)
+                self._buckets[user_id] = bucket
+                # 限制跟踪的用户数量，淘汰最久未请求的用户
+                while len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+                bucket.tokens = min(self.user_burst, bucket.tokens + (now - bucket.updated_at) * self.user_rate)
+                bucket.updated_at = now
+            if bucket.tokens < 1.0:
+                with self._cond:
+                    self._counters['rejected_rate'] += 1
+                retry_after = math.ceil((1.0 - bucket.tokens) / self.user_rate)
+                raise AdmissionRejected(429, '请求过于频繁，请稍后重试', retry_after)
+            bucket.tokens -= 1.0
+
+    def _check_fresh(self, frame_age_ms: Optional[float], received_at: float):
+        """frame_age_ms 为客户端上报的图像相对年龄，received_at 为服务端收到请求的 monotonic 时间"""
+        if frame_age_ms is None or self.max_frame_age_ms <= 0:
+            return
+        age_ms = max(0.0, frame_age_ms) + (time.monotonic() - received_at) * 1000
+        if age_ms > self.max_frame_age_ms:
+            with self._cond:
+                self._counters['dropped_stale'] += 1
+            raise AdmissionRejected(408, '图像已过期，已丢弃')
+
+    def _acquire_slot(self, priority: str):
+        limit = self.max_inflight
+        if priority != PRIORITY_INTERACTIVE:
+            limit -= self.interactive_reserve
+        wait = self.interactive_wait_ms / 1000 if priority == PRIORITY_INTERACTIVE else 0
+        with self._cond:
+            if self._inflight >= limit and wait > 0:
+                self._cond.wait_for(lambda: self._inflight < limit, timeout=wait)
+            if self._inflight >= limit:
+                self._counters['rejected_busy'] += 1
+                raise AdmissionRejected(503, '服务繁忙，请稍后重试', 1)
+            self._inflight += 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, user_id: Optional[str] = None, priority: str = PRIORITY_INTERACTIVE,
+              frame_age_ms: Optional[float] = None, received_at: Optional[float] = None):
+        """准入检查通过后占用一个在途名额，退出时释放；拒绝时抛出 AdmissionRejected
+
+        received_at 缺省为调用时刻（time.monotonic()）。
+        """
+        if received_at is None:
+            received_at = time.monotonic()
+        self._check_fresh(frame_age_ms, received_at)
+        self._acquire_slot(priority)
+        try:
+            # 交互请求可能等待过名额，占用后再确认一次新鲜度；最后才扣令牌
+            self._check_fresh(frame_age_ms, received_at)
+            if user_id:
+                self._take_token(user_id)
+            with self._cond:
+                self._counters['admitted'] += 1
+            yield
+        finally:
+            self._release_slot()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return dict(self._counters, inflight=self._inflight, max_inflight=self.max_inflight)
@@ -8,12 +8,16 @@ import base64
 import os
 import json
 import logging
-from datetime import datetime
-import uuid
+import time
+import atexit
 from typing import Dict, List
 
-from emotion_detector import EmotionDetector
+from emotion_detector import EmotionDetector, FACE_INPUT_SIZE, parse_face_crops
 from music_recommender import MusicRecommender
+from db_pool import PoolTimeout
+from session_store import create_session_store
+from popularity_job import PopularityJob
+from admission import AdmissionController, AdmissionRejected, PRIORITY_INTERACTIVE
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # 配置日志
@@ -47,18 +51,63 @@ socketio = SocketIO(
         "https://8.148.78.190",
         "*"
     ],
-    async_mode="threading"
+    async_mode="threading",
+    # 多 worker / 多节点部署时通过消息队列广播事件，例如本机 redis://127.0.0.1:6379/0；
+    # Engine.IO 连接会话仍在各 worker 内存中，多 worker 时客户端须只用 websocket 传输或由代理做粘性会话
+    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE')
 )
 
 # 初始化
 emotion_detector = EmotionDetector()
 music_recommender = MusicRecommender()
 
-# 全局变量
-active_sessions = {}
+# 情绪识别准入控制（在途上限 / 单用户限流 / 图像新鲜度 / 交互优先）
+detection_admission = AdmissionController.from_env()
+
+# 会话存储（SESSION_STORE=sqlite 时同一主机的所有 worker 共享）
+active_sessions = create_session_store()
 current_emotion = None
 current_song = None
 
+
+def close_resources():
+    """进程退出时释放数据库连接池（uWSGI/gunicorn 等方式运行时不会执行 __main__ 分支）"""
+    music_recommender.close()
+    active_sessions.close()
+
+
+atexit.register(close_resources)
+
+SESSION_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', 60))
+
+def sweep_idle_sessions():
+    """后台定期清理空闲超时的会话"""
+    while True:
+        socketio.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            removed = active_sessions.sweep()
+            if removed:
+                logger.info(f"清理空闲会话 {removed} 个，当前存活 {len(active_sessions)} 个")
+        except Exception as e:
+            logger.error(f"清理空闲会话失败: {e}")
+
+socketio.start_background_task(sweep_idle_sessions)
+
+# 时间衰减热度重算（增量处理水位线之后的 play_history）
+popularity_job = PopularityJob.from_env(music_recommender.db_pool)
+POPULARITY_JOB_INTERVAL = float(os.environ.get('POPULARITY_JOB_INTERVAL', 600))
+
+def recompute_popularity():
+    """后台定期重算歌曲热度"""
+    while True:
+        try:
+            popularity_job.run()
+        except Exception as e:
+            logger.error(f"热度重算任务异常: {e}")
+        socketio.sleep(POPULARITY_JOB_INTERVAL)
+
+socketio.start_background_task(recompute_popularity)
+
 @app.route('/')
 def index():
     """主页"""
@@ -75,6 +124,31 @@ def health_check():
     """健康检查端点，用于运维与负载均衡存活探测"""
     return jsonify({'status': 'ok'})
 
+@app.route('/api/session-stats', methods=['GET'])
+def session_stats():
+    """会话表指标：存活、淘汰与峰值数量"""
+    return jsonify({
+        'success': True,
+        'sessions': active_sessions.stats()
+    })
+
+@app.route('/api/detection-stats', methods=['GET'])
+def detection_stats():
+    """情绪识别准入指标：在途数量与各类拒绝计数"""
+    return jsonify({
+        'success': True,
+        'detection': detection_admission.stats()
+    })
+
+@app.route('/api/db-stats', methods=['GET'])
+def db_stats():
+    """数据库连接池健康状态与使用统计"""
+    return jsonify({
+        'success': True,
+        'healthy': music_recommender.db_pool.healthy(),
+        'pool': music_recommender.db_pool.stats()
+    })
+
 @app.route('/api/emotions', methods=['GET'])
 def get_emotions():
     """获取所有支持的情绪"""
@@ -84,62 +158,149 @@ def get_emotions():
         'emotions': emotions
     })
 
+def admission_rejected_response(e: AdmissionRejected):
+    """准入被拒时快速返回 429/503/408，并按需携带 Retry-After"""
+    rv = jsonify({'success': False, 'error': e.message})
+    rv.status_code = e.status
+    if e.retry_after is not None:
+        rv.headers['Retry-After'] = str(e.retry_after)
+    return rv
+
+def pool_timeout_response(e: PoolTimeout):
+    """数据库连接池耗尽时返回 503 并携带 Retry-After，与程序异常（500）区分"""
+    rv = jsonify({'success': False, 'error': '服务繁忙，请稍后重试'})
+    rv.status_code = 503
+    rv.headers['Retry-After'] = '1'
+    logger.warning(f"数据库连接池耗尽: {e}")
+    return rv
+
+# 群体模式单帧最多分类的人脸数量，限制拥挤画面的计算开销
+GROUP_MAX_FACES = int(os.environ.get('GROUP_MAX_FACES', 8))
+
+def parse_frame_age_ms(value):
+    """解析客户端上报的图像相对年龄（拍摄到发送的毫秒数），缺失或非法时返回 None"""
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit_key(user_id):
+    """单用户限流的键：优先使用 user_id，匿名请求退回客户端地址（ProxyFix 已还原真实 IP）"""
+    return user_id or request.remote_addr
+
 @app.route('/api/detect-emotion', methods=['POST'])
 def detect_emotion():
     """情绪识别接口（支持 JSON base64 与 multipart 文件上传）"""
+    received_at = time.monotonic()
     try:
-        frame = None
+        image_bytes = None
         user_id = None
         mode = 'auto'
 
         content_type = request.headers.get('Content-Type', '')
         if 'multipart/form-data' in content_type and 'file' in request.files:
-            file_storage = request.files['file']
-            image_bytes = file_storage.read()
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            user_id = request.form.get('user_id')
-            mode = request.form.get('mode', 'auto')
+            image_bytes = request.files['file'].read()
+            params = request.form
         else:
-            data = request.get_json(silent=True) or {}
-            image_data = data.get('image')
-            user_id = data.get('user_id')
-            mode = data.get('mode', 'auto')
+            params = request.get_json(silent=True) or {}
+            image_data = params.get('image')
             if image_data and isinstance(image_data, str):
                 b64_payload = image_data.split(',')[1] if ',' in image_data else image_data
                 approx_bytes = int(len(b64_payload) * 3 / 4)
                 if approx_bytes > 2 * 1024 * 1024:
                     return jsonify({'success': False, 'error': '图像过大，请降低清晰度后重试'}), 413
                 image_bytes = base64.b64decode(b64_payload)
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        user_id = params.get('user_id')
+        mode = params.get('mode', 'auto')
+        priority = params.get('priority', PRIORITY_INTERACTIVE)
+        frame_age_ms = parse_frame_age_ms(params.get('frame_age_ms'))
+        group = str(params.get('group', '')).lower() in ('1', 'true', 'yes')
+        try:
+            max_faces = min(int(params.get('max_faces', GROUP_MAX_FACES)), GROUP_MAX_FACES)
+        except (TypeError, ValueError):
+            max_faces = GROUP_MAX_FACES
 
-        if frame is None:
+        if not image_bytes:
             return jsonify({'success': False, 'error': '缺少图像数据'}), 400
 
-        emotion, confidence, all_emotions = emotion_detector.detect_emotion(frame)
+        # 解码与识别都在准入名额内进行，过载时快速失败而不是排队到客户端超时
+        with detection_admission.admit(rate_limit_key(user_id), priority, frame_age_ms, received_at):
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if frame is None:
+                return jsonify({'success': False, 'error': '缺少图像数据'}), 400
+            if group:
+                emotion, confidence, all_emotions, faces = emotion_detector.detect_group_emotion(frame, max(1, max_faces))
+            else:
+                emotion, confidence, all_emotions = emotion_detector.detect_emotion(frame)
 
-        recommendations = music_recommender.get_recommendations(
-            emotion,
-            user_id=user_id,
-            limit=5,
-            mode=mode
-        )
+        result = build_emotion_result(emotion, confidence, all_emotions, user_id, mode)
+        if group:
+            # 群体模式：顶层为置信度加权的群体情绪，逐脸结果含人脸框
+            result['faces'] = faces
+            result['face_count'] = len(faces)
+        return jsonify(result)
 
-        logger.info(f"情绪: {emotion}, 推荐数量: {len(recommendations)}")
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except Exception as e:
+        logger.error(f"情绪识别失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        return jsonify({
-            'success': True,
-            'emotion': emotion,
-            'emotion_name': emotion_detector.get_emotion_name(emotion),
-            'confidence': confidence,
-            'all_emotions': all_emotions,
-            'recommendations': recommendations,
-            'description': music_recommender.get_emotion_description(emotion)
-        })
+def build_emotion_result(emotion, confidence, all_emotions, user_id=None, mode='auto'):
+    """组装情绪识别响应（/api/detect-emotion 与 /api/classify-face 共用）"""
+    recommendations = music_recommender.get_recommendations(
+        emotion,
+        user_id=user_id,
+        limit=5,
+        mode=mode
+    )
+
+    logger.info(f"情绪: {emotion}, 推荐数量: {len(recommendations)}")
+
+    return {
+        'success': True,
+        'emotion': emotion,
+        'emotion_name': emotion_detector.get_emotion_name(emotion),
+        'confidence': confidence,
+        'all_emotions': all_emotions,
+        'recommendations': recommendations,
+        'description': music_recommender.get_emotion_description(emotion)
+    }
+
+# 单次请求最多携带的人脸裁剪数量
+MAX_FACE_BATCH = int(os.environ.get('MAX_FACE_BATCH', 16))
+
+@app.route('/api/classify-face', methods=['POST'])
+def classify_face():
+    """人脸裁剪分类接口：请求体为 64x64 灰度人脸的原始字节（可多张拼接），跳过解码与人脸检测"""
+    received_at = time.monotonic()
+    try:
+        user_id = request.args.get('user_id')
+        mode = request.args.get('mode', 'auto')
+        priority = request.args.get('priority', PRIORITY_INTERACTIVE)
+        frame_age_ms = parse_frame_age_ms(request.args.get('frame_age_ms'))
+
+        gray_faces = parse_face_crops(request.get_data(), MAX_FACE_BATCH)
+        if gray_faces is None:
+            return jsonify({
+                'success': False,
+                'error': f'人脸数据格式错误，应为 1~{MAX_FACE_BATCH} 张 {FACE_INPUT_SIZE[0]}x{FACE_INPUT_SIZE[1]} 灰度图的原始字节'
+            }), 400
+
+        with detection_admission.admit(rate_limit_key(user_id), priority, frame_age_ms, received_at):
+            emotion, confidence, all_emotions, faces = emotion_detector.classify_face_batch(gray_faces)
 
+        result = build_emotion_result(emotion, confidence, all_emotions, user_id, mode)
+        # 逐张结果与群体模式结构一致（无人脸框）
+        result['faces'] = faces
+        result['face_count'] = len(faces)
+        return jsonify(result)
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
-        logger.error(f"情绪识别失败: {e}")
+        logger.error(f"人脸分类失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/recommendations', methods=['GET'])
@@ -173,9 +334,10 @@ def get_music_file(song_id):
     """获取音乐文件"""
     try:
         # 从数据库获取歌曲信息
-        conn, cursor = music_recommender.get_db_connection()
-        cursor.execute('SELECT file_path FROM music_metadata WHERE song_id = ?', (song_id,))
-        result = cursor.fetchone()
+        with music_recommender.db_pool.reader() as conn:
+            result = conn.execute(
+                'SELECT file_path FROM music_metadata WHERE song_id = ?', (song_id,)
+            ).fetchone()
  
         if not result:
             return jsonify({'success': False, 'error': '歌曲不存在'}), 404
@@ -215,6 +377,8 @@ def get_music_file(song_id):
         # 无Range头，直接完整返回
         return send_file(abs_path, mimetype='audio/mpeg')
  
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         logger.error(f"获取音乐文件失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -258,6 +422,8 @@ def get_popular_songs():
             'popular_songs': popular_songs
         })
         
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         logger.error(f"获取热门歌曲失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -271,36 +437,35 @@ def get_user_stats():
         if not user_id:
             return jsonify({'success': False, 'error': '缺少用户ID'}), 400
         
-        conn, cursor = music_recommender.get_db_connection()
-        
-        # 获取用户播放历史
-        cursor.execute('''
-            SELECT emotion, COUNT(*) as play_count, AVG(rating) as avg_rating
-            FROM play_history 
-            WHERE user_id = ?
-            GROUP BY emotion
-        ''', (user_id,))
+        with music_recommender.db_pool.reader() as conn:
+            # 获取用户播放历史
+            emotion_rows = conn.execute('''
+                SELECT emotion, COUNT(*) as play_count, AVG(rating) as avg_rating
+                FROM play_history 
+                WHERE user_id = ?
+                GROUP BY emotion
+            ''', (user_id,)).fetchall()
+            
+            # 获取用户偏好（注意：这里需要先创建user_preferences表，或者使用现有的play_history表）
+            preference_rows = conn.execute('''
+                SELECT emotion, song_id, rating, COUNT(*) as play_count
+                FROM play_history 
+                WHERE user_id = ? AND rating IS NOT NULL
+                GROUP BY emotion, song_id, rating
+                ORDER BY rating DESC, play_count DESC
+                LIMIT 10
+            ''', (user_id,)).fetchall()
         
         emotion_stats = []
-        for row in cursor.fetchall():
+        for row in emotion_rows:
             emotion_stats.append({
                 'emotion': row[0],
                 'play_count': row[1],
                 'avg_rating': row[2] if row[2] else 0
             })
         
-        # 获取用户偏好（注意：这里需要先创建user_preferences表，或者使用现有的play_history表）
-        cursor.execute('''
-            SELECT emotion, song_id, rating, COUNT(*) as play_count
-            FROM play_history 
-            WHERE user_id = ? AND rating IS NOT NULL
-            GROUP BY emotion, song_id, rating
-            ORDER BY rating DESC, play_count DESC
-            LIMIT 10
-        ''', (user_id,))
-        
         preferences = []
-        for row in cursor.fetchall():
+        for row in preference_rows:
             preferences.append({
                 'emotion': row[0],
                 'song_id': row[1],
@@ -314,29 +479,46 @@ def get_user_stats():
             'preferences': preferences
         })
         
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         logger.error(f"获取用户统计失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # WebSocket事件处理
+def get_or_restore_session(session_id, notify=True):
+    """获取会话；连接仍在但会话已被容量淘汰或空闲清理时重建空会话
+
+    notify 为 True 时发送 session_created(restored=True)，提示客户端重新发送 start_session。
+    """
+    session = active_sessions.get(session_id)
+    if session is None:
+        active_sessions.create(session_id, {
+            'user_id': None,
+            'current_emotion': None,
+            'current_song': None
+        })
+        if notify:
+            emit('session_created', {'session_id': session_id, 'restored': True})
+        session = active_sessions.get(session_id)
+    return session
+
 @socketio.on('connect')
 def handle_connect():
     """客户端连接"""
-    session_id = str(uuid.uuid4())
-    active_sessions[session_id] = {
+    session_id = request.sid
+    active_sessions.create(session_id, {
         'user_id': None,
         'current_emotion': None,
-        'current_song': None,
-        'connected_at': datetime.now()
-    }
+        'current_song': None
+    })
     emit('session_created', {'session_id': session_id})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """客户端断开连接"""
     session_id = request.sid
-    if session_id in active_sessions:
-        del active_sessions[session_id]
+    active_sessions.delete(session_id)
 
 @socketio.on('start_session')
 def handle_start_session(data):
@@ -344,9 +526,9 @@ def handle_start_session(data):
     session_id = request.sid
     user_id = data.get('user_id')
     
-    if session_id in active_sessions:
-        active_sessions[session_id]['user_id'] = user_id
-        emit('session_started', {'user_id': user_id})
+    get_or_restore_session(session_id, notify=False)
+    active_sessions.update(session_id, user_id=user_id)
+    emit('session_started', {'user_id': user_id})
 
 @socketio.on('emotion_detected')
 def handle_emotion_detected(data):
@@ -355,21 +537,54 @@ def handle_emotion_detected(data):
     emotion = data.get('emotion')
     confidence = data.get('confidence')
     
-    if session_id in active_sessions:
-        active_sessions[session_id]['current_emotion'] = emotion
-        
-        # 获取推荐
-        recommendations = music_recommender.get_recommendations(
-            emotion, 
-            user_id=active_sessions[session_id]['user_id'],
-            limit=3
-        )
-        
-        emit('recommendations_updated', {
-            'emotion': emotion,
-            'confidence': confidence,
-            'recommendations': recommendations
-        })
+    session = get_or_restore_session(session_id)
+    active_sessions.update(session_id, current_emotion=emotion)
+    
+    # 获取推荐
+    recommendations = music_recommender.get_recommendations(
+        emotion, 
+        user_id=session['user_id'],
+        limit=3
+    )
+    
+    emit('recommendations_updated', {
+        'emotion': emotion,
+        'confidence': confidence,
+        'recommendations': recommendations
+    })
+
+@socketio.on('classify_face')
+def handle_classify_face(data):
+    """处理人脸裁剪分类（data.face 为二进制附件），结果通过 emotion_classified 返回"""
+    session_id = request.sid
+    if not isinstance(data, dict):
+        emit('emotion_classified', {'success': False, 'error': '请求数据格式错误'})
+        return
+
+    try:
+        session = get_or_restore_session(session_id)
+
+        gray_faces = parse_face_crops(data.get('face'), MAX_FACE_BATCH)
+        if gray_faces is None:
+            emit('emotion_classified', {'success': False, 'error': '人脸数据格式错误'})
+            return
+
+        # WebSocket 连接以会话ID作为限流键
+        with detection_admission.admit(session_id, data.get('priority', PRIORITY_INTERACTIVE),
+                                       parse_frame_age_ms(data.get('frame_age_ms'))):
+            emotion, confidence, all_emotions, faces = emotion_detector.classify_face_batch(gray_faces)
+
+        active_sessions.update(session_id, current_emotion=emotion)
+        result = build_emotion_result(emotion, confidence, all_emotions, session['user_id'], data.get('mode', 'auto'))
+        result['faces'] = faces
+        result['face_count'] = len(faces)
+        emit('emotion_classified', result)
+
+    except AdmissionRejected as e:
+        emit('emotion_classified', {'success': False, 'error': e.message, 'retry_after': e.retry_after})
+    except Exception as e:
+        logger.error(f"人脸分类失败: {e}")
+        emit('emotion_classified', {'success': False, 'error': str(e)})
 
 @socketio.on('song_selected')
 def handle_song_selected(data):
@@ -377,17 +592,17 @@ def handle_song_selected(data):
     session_id = request.sid
     song_id = data.get('song_id')
     
-    if session_id in active_sessions:
-        active_sessions[session_id]['current_song'] = song_id
-        
-        # 记录用户交互
-        user_id = active_sessions[session_id]['user_id']
-        emotion = active_sessions[session_id]['current_emotion']
-        
-        if user_id and emotion:
-            music_recommender.record_user_interaction(
-                user_id, song_id, emotion, 'play'
-            )
+    session = get_or_restore_session(session_id)
+    active_sessions.update(session_id, current_song=song_id)
+    
+    # 记录用户交互
+    user_id = session['user_id']
+    emotion = session['current_emotion']
+    
+    if user_id and emotion:
+        music_recommender.record_user_interaction(
+            user_id, song_id, emotion, 'play'
+        )
 
 @socketio.on('rating_submitted')
 def handle_rating_submitted(data):
@@ -396,16 +611,16 @@ def handle_rating_submitted(data):
     song_id = data.get('song_id')
     rating = data.get('rating')
     
-    if session_id in active_sessions:
-        user_id = active_sessions[session_id]['user_id']
-        emotion = active_sessions[session_id]['current_emotion']
+    session = get_or_restore_session(session_id)
+    user_id = session['user_id']
+    emotion = session['current_emotion']
+    
+    if user_id and emotion:
+        music_recommender.record_user_interaction(
+            user_id, song_id, emotion, 'rating', rating
+        )
         
-        if user_id and emotion:
-            music_recommender.record_user_interaction(
-                user_id, song_id, emotion, 'rating', rating
-            )
-            
-            emit('rating_recorded', {'success': True})
+        emit('rating_recorded', {'success': True})
 
 if __name__ == '__main__':
     try:
@@ -416,7 +631,5 @@ if __name__ == '__main__':
         socketio.run(app, host='0.0.0.0', port=8000, debug=False)
     except KeyboardInterrupt:
         logger.info("系统关闭中...")
-        music_recommender.close()
     except Exception as e:
-        logger.error(f"系统启动失败: {e}")
-        music_recommender.close()
\ No newline at end of file
+        logger.error(f"系统启动失败: {e}")
\ No newline at end of file
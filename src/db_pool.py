@@ -0,0 +1,158 @@
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+
+class PoolTimeout(Exception):
+    """等待空闲只读连接超时"""
+
+
+class SQLitePool:
+    """有界 SQLite 连接池：若干只读连接（query_only）+ 一个专用写连接
+
+    - 读连接按需创建，总数不超过 max_readers，用完归还复用，不随线程泄漏。
+    - 写连接全局唯一，由锁串行化，事务以 BEGIN IMMEDIATE 开始。
+    - 每个连接启用 cached_statements 预编译语句缓存。
+    - 数据库使用 WAL 模式，读连接不会被写事务阻塞。
+    """
+
+    def __init__(self, db_path: str, max_readers: int = 4, timeout: float = 5.0,
+                 cached_statements: int = 128):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+
+        self._idle_readers: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue(maxsize=max_readers)
+        self._all_readers = []
+        self._reader_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+        self._stats = {'reader_acquires': 0, 'reader_waits': 0, 'reader_timeouts': 0,
+                       'writer_acquires': 0, 'writer_rollbacks': 0}
+        self._stats_lock = threading.Lock()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.close()
+
+    @classmethod
+    def from_env(cls, db_path: str) -> 'SQLitePool':
+        return cls(
+            db_path,
+            max_readers=int(os.environ.get('DB_POOL_READERS', 4)),
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5.0)),
+            cached_statements=int(os.environ.get('DB_POOL_STMT_CACHE', 128))
+        )
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        # 连接在池内跨线程复用，但同一时刻只被一个线程持有
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements, isolation_level=None)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError('连接池已关闭')
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._closed:
+                raise RuntimeError('连接池已关闭')
+            if len(self._all_readers) < self.max_readers:
+                conn = self._connect(read_only=True)
+                self._all_readers.append(conn)
+                return conn
+        self._count('reader_waits')
+        try:
+            return self._idle_readers.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count('reader_timeouts')
+            raise PoolTimeout(f'等待只读连接超时（{self.timeout}s）')
+
+    @contextmanager
+    def reader(self):
+        """借出一个只读连接，退出时归还"""
+        conn = self._acquire_reader()
+        self._count('reader_acquires')
+        try:
+            yield conn
+        finally:
+            # 与 close() 在同一把锁下判断并归还，避免归还到已清空的队列后无人关闭
+            with self._reader_lock:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle_readers.put_nowait(conn)
+
+    @contextmanager
+    def writer(self):
+        """持有唯一的写连接并开启事务，正常退出提交、异常回滚"""
+        with self._writer_lock:
+            if self._closed:
+                raise RuntimeError('连接池已关闭')
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            self._count('writer_acquires')
+            conn = self._writer
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                self._count('writer_rollbacks')
+                raise
+
+    def healthy(self) -> bool:
+        """用只读连接执行 SELECT 1 检查数据库可用性"""
+        try:
+            with self.reader() as conn:
+                return conn.execute('SELECT 1').fetchone()[0] == 1
+        except Exception as e:
+            self.logger.error(f"数据库健康检查失败: {e}")
+            return False
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'readers_open': len(self._all_readers),
+            'readers_idle': self._idle_readers.qsize(),
+            'max_readers': self.max_readers,
+            'cached_statements': self.cached_statements,
+            'writer_open': self._writer is not None,
+            'closed': self._closed
+        })
+        return stats
+
+    def close(self):
+        """关闭所有空闲连接与写连接；借出中的读连接在归还时关闭"""
+        with self._reader_lock:
+            self._closed = True
+            self._all_readers.clear()
+            while True:
+                try:
+                    self._idle_readers.get_nowait().close()
+                except queue.Empty:
+                    break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
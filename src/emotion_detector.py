@@ -1,7 +1,18 @@
 import cv2
+import logging
 from fer import FER
 import numpy as np
 
+# FER 表情分类器的原生输入尺寸（灰度 64x64）
+FACE_INPUT_SIZE = (64, 64)
+
+def parse_face_crops(raw: bytes, max_faces: int):
+    """把原始字节解析为 (N, 64, 64) 灰度人脸批次；为空、长度不是单张字节数的整数倍或超过 max_faces 张时返回 None"""
+    face_bytes = FACE_INPUT_SIZE[0] * FACE_INPUT_SIZE[1]
+    if not isinstance(raw, (bytes, bytearray)) or not raw or len(raw) % face_bytes != 0 or len(raw) // face_bytes > max_faces:
+        return None
+    return np.frombuffer(raw, np.uint8).reshape(-1, FACE_INPUT_SIZE[0], FACE_INPUT_SIZE[1])
+
 class EmotionDetector:
     """基于 OpenCV + FER 的智能情绪识别器"""
     def __init__(self, use_mtcnn=False):
@@ -9,6 +20,17 @@ class EmotionDetector:
         self.emotions = [
             'angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral'
         ]
+        self.check_face_input_size()
+
+    def check_face_input_size(self):
+        """classify_faces 依赖 FER 内部分类器，确认其输入尺寸与 FACE_INPUT_SIZE 一致"""
+        classifier = getattr(self.detector, '_FER__emotion_classifier', None)
+        if classifier is None:
+            logging.getLogger(__name__).warning("未找到 FER 表情分类器，无法校验人脸裁剪输入尺寸")
+            return
+        input_size = tuple(classifier.input_shape[1:3])
+        if input_size != FACE_INPUT_SIZE:
+            raise ValueError(f"FER 分类器输入尺寸 {input_size} 与 FACE_INPUT_SIZE {FACE_INPUT_SIZE} 不一致")
 
     def detect_emotion(self, frame: np.ndarray):
         results = self.detector.detect_emotions(frame)
@@ -20,6 +42,59 @@ class EmotionDetector:
         confidence = emotions[dominant_emotion]
         return dominant_emotion, confidence, emotions
 
+    def detect_group_emotion(self, frame: np.ndarray, max_faces: int = 8):
+        """群体模式：对画面中面积最大的 max_faces 张脸一次批量分类，返回 (群体情绪, 置信度, 群体概率, 逐脸结果)
+
+        群体概率为各脸概率按其置信度加权的平均。
+        """
+        boxes = sorted(self.detector.find_faces(frame), key=lambda b: b[2] * b[3], reverse=True)[:max_faces]
+        if not boxes:
+            return 'neutral', 0.0, {'neutral': 1.0}, []
+        # 传入已检测的人脸框，FER 内部对所有人脸做一次批量前向
+        results = self.detector.detect_emotions(frame, face_rectangles=boxes)
+        faces = [
+            dict(box=[int(v) for v in result['box']], **self._face_result(result['emotions']))
+            for result in results
+        ]
+        return self._aggregate_faces(faces)
+
+    def _face_result(self, emotions: dict):
+        """单张脸的结果：{emotion, confidence, all_emotions}"""
+        dominant_emotion = max(emotions, key=emotions.get)
+        return {
+            'emotion': dominant_emotion,
+            'confidence': emotions[dominant_emotion],
+            'all_emotions': emotions
+        }
+
+    def _aggregate_faces(self, faces: list):
+        """多张脸的概率按各自置信度加权平均，返回 (主要情绪, 置信度, 加权概率, 逐脸结果)"""
+        if not faces:
+            return 'neutral', 0.0, {'neutral': 1.0}, []
+        total_weight = sum(face['confidence'] for face in faces) or 1.0
+        group_emotions = {
+            label: round(sum(face['all_emotions'].get(label, 0.0) * face['confidence'] for face in faces) / total_weight, 2)
+            for label in self.emotions
+        }
+        dominant_emotion = max(group_emotions, key=group_emotions.get)
+        return dominant_emotion, group_emotions[dominant_emotion], group_emotions, faces
+
+    def classify_faces(self, gray_faces: np.ndarray):
+        """只执行分类阶段：输入 (N, 64, 64) uint8 灰度人脸裁剪，返回每张脸的情绪概率"""
+        # 与 FER 内部预处理一致：缩放到 [-1, 1]
+        batch = gray_faces.astype(np.float32) / 255.0
+        batch = (batch - 0.5) * 2.0
+        predictions = np.asarray(self.detector._classify_emotions(batch[..., np.newaxis]))
+        return [
+            {label: round(float(score), 2) for label, score in zip(self.emotions, scores)}
+            for scores in predictions
+        ]
+
+    def classify_face_batch(self, gray_faces: np.ndarray):
+        """对一批人脸裁剪分类，聚合方式与群体模式相同，返回 (主要情绪, 置信度, 加权概率, 逐张结果)"""
+        faces = [self._face_result(emotions) for emotions in self.classify_faces(gray_faces)]
+        return self._aggregate_faces(faces)
+
     def get_emotion_name(self, emotion_code: str) -> str:
         mapping = {
             'angry': '愤怒', 'disgust': '厌恶', 'fear': '恐惧',
@@ -28,4 +103,4 @@ class EmotionDetector:
         return mapping.get(emotion_code, emotion_code)
 
     def get_all_emotions(self):
-        return self.emotions 
\ No newline at end of file
+        return self.emotions
\ No newline at end of file
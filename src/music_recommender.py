@@ -5,7 +5,8 @@ import sqlite3
 from typing import List, Dict, Optional, Tuple
 import logging
 from datetime import datetime
-import threading
+
+from db_pool import SQLitePool, PoolTimeout
 
 class MusicRecommender:
     """音乐推荐系统"""
@@ -29,9 +30,6 @@ class MusicRecommender:
         # 数据库路径
         self.db_path = os.path.join(self.project_root, 'music_recommendations.db')
         
-        # 线程本地存储
-        self._local = threading.local()
-        
         # 情绪-音乐映射关系
         self.emotion_music_mapping = {
             'angry': {'description': '愤怒情绪推荐释放压力、节奏强烈的音乐', 'tags': ['intense', 'powerful', 'cathartic', 'energetic']},
@@ -46,28 +44,12 @@ class MusicRecommender:
         # 初始化数据库
         self.init_database()
         
+        # 连接池：只读连接用于查询，唯一写连接用于写入
+        self.db_pool = SQLitePool.from_env(self.db_path)
+        
         # 加载音乐库
         self.music_library = self.load_music_library()
     
-    def get_db_connection(self):
-        """获取数据库连接，支持多线程"""
-        if not hasattr(self._local, 'connection') or self._local.connection is None:
-            self._local.connection = sqlite3.connect(self.db_path)
-            self._local.cursor = self._local.connection.cursor()
-        return self._local.connection, self._local.cursor
-    
-    @property
-    def cursor(self):
-        """获取当前线程的数据库游标"""
-        _, cursor = self.get_db_connection()
-        return cursor
-    
-    @property
-    def conn(self):
-        """获取当前线程的数据库连接"""
-        conn, _ = self.get_db_connection()
-        return conn
-    
     def init_database(self):
         """初始化数据库"""
         try:
@@ -103,6 +85,26 @@ class MusicRecommender:
                 )
             ''')
             
+            # 创建时间衰减热度表（由 PopularityJob 定期重算）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS song_popularity (
+                    song_id TEXT,
+                    emotion TEXT,
+                    score REAL DEFAULT 0.0,
+                    updated_at REAL,
+                    PRIMARY KEY (song_id, emotion)
+                )
+            ''')
+            
+            # 创建热度重算水位线表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS popularity_watermark (
+                    job TEXT PRIMARY KEY,
+                    last_row_id INTEGER DEFAULT 0,
+                    last_run_at REAL
+                )
+            ''')
+            
             # 创建用户统计表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS user_stats (
@@ -167,20 +169,20 @@ class MusicRecommender:
     def save_song_metadata(self, song_info: Dict):
         """保存歌曲元数据到数据库"""
         try:
-            self.cursor.execute('''
-                INSERT OR REPLACE INTO music_metadata 
-                (song_id, title, artist, emotion_category, file_path, duration, popularity_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                song_info['id'],
-                song_info['title'],
-                song_info['artist'],
-                song_info['emotion_category'],
-                song_info['file_path'],
-                song_info['duration'],
-                song_info['popularity_score']
-            ))
-            self.conn.commit()
+            with self.db_pool.writer() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO music_metadata 
+                    (song_id, title, artist, emotion_category, file_path, duration, popularity_score)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    song_info['id'],
+                    song_info['title'],
+                    song_info['artist'],
+                    song_info['emotion_category'],
+                    song_info['file_path'],
+                    song_info['duration'],
+                    song_info['popularity_score']
+                ))
         except Exception as e:
             self.logger.error(f"保存歌曲元数据失败: {e}")
     
@@ -197,8 +199,12 @@ class MusicRecommender:
         
         # 根据播放模式排序
         if mode == 'auto':
-            # 自动模式：按流行度排序
-            available_songs.sort(key=lambda x: x.get('popularity_score', 0), reverse=True)
+            # 自动模式：按时间衰减热度排序
+            scores = self.get_decayed_scores(emotion)
+            available_songs = [
+                dict(song, popularity_score=scores.get(song['id'], 0.0)) for song in available_songs
+            ]
+            available_songs.sort(key=lambda x: x['popularity_score'], reverse=True)
         else:
             # 手动模式：随机排序
             random.shuffle(available_songs)
@@ -209,39 +215,45 @@ class MusicRecommender:
                               action: str = None, rating: int = None, play_mode: str = 'auto'):
         """记录用户交互"""
         try:
-            # 记录播放历史（包含所有列）
-            self.cursor.execute('''
-                INSERT INTO play_history 
-                (user_id, song_id, emotion, action, rating, play_mode)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, song_id, emotion, action, rating, play_mode))
-            
-            # 更新歌曲流行度
-            if rating:
-                self.cursor.execute('''
-                    UPDATE music_metadata 
-                    SET popularity_score = popularity_score + ?
-                    WHERE song_id = ?
-                ''', (rating, song_id))
-            
-            self.conn.commit()
+            with self.db_pool.writer() as conn:
+                # 记录播放历史（包含所有列）
+                conn.execute('''
+                    INSERT INTO play_history 
+                    (user_id, song_id, emotion, action, rating, play_mode)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, song_id, emotion, action, rating, play_mode))
+                # 歌曲热度由 PopularityJob 基于 play_history 定期重算，这里不再累加
             
         except Exception as e:
             self.logger.error(f"记录用户交互失败: {e}")
     
+    def get_decayed_scores(self, emotion: str) -> Dict[str, float]:
+        """获取某情绪下各歌曲的时间衰减热度"""
+        try:
+            with self.db_pool.reader() as conn:
+                rows = conn.execute(
+                    'SELECT song_id, score FROM song_popularity WHERE emotion = ?', (emotion,)
+                ).fetchall()
+            return dict(rows)
+        except Exception as e:
+            self.logger.error(f"获取衰减热度失败: {e}")
+            return {}
+    
     def get_popular_songs(self, emotion: str, limit: int = 5) -> List[Dict]:
-        """获取热门歌曲"""
+        """获取热门歌曲（按时间衰减热度）"""
         try:
-            self.cursor.execute('''
-                SELECT song_id, popularity_score
-                FROM music_metadata 
-                WHERE emotion_category = ?
-                ORDER BY popularity_score DESC
-                LIMIT ?
-            ''', (emotion, limit))
+            with self.db_pool.reader() as conn:
+                rows = conn.execute('''
+                    SELECT m.song_id, COALESCE(p.score, 0.0) AS score
+                    FROM music_metadata m
+                    LEFT JOIN song_popularity p ON p.song_id = m.song_id AND p.emotion = ?
+                    WHERE m.emotion_category = ?
+                    ORDER BY score DESC
+                    LIMIT ?
+                ''', (emotion, emotion, limit)).fetchall()
             
             popular_songs = []
-            for row in self.cursor.fetchall():
+            for row in rows:
                 song_id, popularity_score = row
                 # 从音乐库中获取完整信息
                 for songs in self.music_library.values():
@@ -254,6 +266,9 @@ class MusicRecommender:
             
             return popular_songs
             
+        except PoolTimeout:
+            # 连接池耗尽交给调用方返回 503，而不是伪装成没有热门歌曲
+            raise
         except Exception as e:
             self.logger.error(f"获取热门歌曲失败: {e}")
             return []
@@ -263,13 +278,11 @@ class MusicRecommender:
         return self.emotion_music_mapping.get(emotion, {}).get('description', '')
     
     def close(self):
-        """关闭数据库连接"""
+        """关闭连接池中的所有数据库连接"""
         try:
-            # 关闭当前线程的连接
-            if hasattr(self._local, 'connection') and self._local.connection:
-                self._local.connection.close()
-                self._local.connection = None
-                self._local.cursor = None
+            pool = getattr(self, 'db_pool', None)
+            if pool is not None:
+                pool.close()
         except Exception as e:
             self.logger.error(f"关闭数据库连接失败: {e}")
     
@@ -0,0 +1,134 @@
+import os
+import math
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from db_pool import SQLitePool
+
+
+class PopularityJob:
+    """基于 play_history 的时间衰减热度重算任务
+
+    热度按指数衰减累计：score = Σ weight · exp(-λ·(now - t))，λ = ln2 / 半衰期。
+    song_popularity 中保存的是截至 popularity_watermark.last_run_at 的分数，
+    每次运行先把已有分数整体衰减到当前时间，再按游标（play_history.id）分块
+    读取水位线之后的新记录累加，最后在同一个事务中写回并推进水位线。
+    """
+
+    JOB_NAME = 'decayed_popularity'
+
+    def __init__(self, db_pool: SQLitePool, half_life_days: float = 14.0,
+                 chunk_size: int = 5000, play_weight: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.db_pool = db_pool
+        self.decay_rate = math.log(2) / (half_life_days * 86400)
+        self.chunk_size = chunk_size
+        # 无评分的播放记录的权重，有评分时权重为评分值
+        self.play_weight = play_weight
+
+    @classmethod
+    def from_env(cls, db_pool: SQLitePool) -> 'PopularityJob':
+        return cls(
+            db_pool,
+            half_life_days=float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', 14)),
+            chunk_size=int(os.environ.get('POPULARITY_CHUNK_SIZE', 5000))
+        )
+
+    def _time_column(self, cursor) -> str:
+        """兼容旧库：播放时间列可能是 timestamp 或 played_at"""
+        cursor.execute('PRAGMA table_info(play_history)')
+        columns = [column[1] for column in cursor.fetchall()]
+        return 'timestamp' if 'timestamp' in columns else 'played_at'
+
+    def _read_watermark(self, cursor) -> Tuple[int, Optional[float]]:
+        cursor.execute(
+            'SELECT last_row_id, last_run_at FROM popularity_watermark WHERE job = ?',
+            (self.JOB_NAME,)
+        )
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def _accumulate(self, cursor, last_row_id: int, now: float) -> Tuple[Dict[Tuple[str, str], float], int, int]:
+        """按游标分块读取新记录，返回 {(song_id, emotion): 衰减到 now 的增量}、新水位线与处理行数"""
+        time_column = self._time_column(cursor)
+        # (歌曲, 情绪) -> totals 下标
+        key_index: Dict[Tuple[str, str], int] = {}
+        totals = np.zeros(0, dtype=np.float64)
+        processed = 0
+        while True:
+            cursor.execute(f'''
+                SELECT id, song_id, emotion, rating, CAST(strftime('%s', {time_column}) AS REAL)
+                FROM play_history
+                WHERE id > ? AND song_id IS NOT NULL AND emotion IS NOT NULL
+                ORDER BY id
+                LIMIT ?
+            ''', (last_row_id, self.chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_row_id = rows[-1][0]
+            processed += len(rows)
+
+            ratings = np.array([row[3] if row[3] is not None else np.nan for row in rows], dtype=np.float64)
+            played_at = np.array([row[4] if row[4] is not None else now for row in rows], dtype=np.float64)
+            weights = np.where(np.isnan(ratings), self.play_weight, ratings)
+            decayed = weights * np.exp(-self.decay_rate * np.clip(now - played_at, 0, None))
+
+            # 按 (歌曲, 情绪) 聚合
+            inverse = np.fromiter(
+                (key_index.setdefault((row[1], row[2]), len(key_index)) for row in rows),
+                dtype=np.int64, count=len(rows)
+            )
+            chunk_totals = np.bincount(inverse, weights=decayed, minlength=len(key_index))
+            totals = np.pad(totals, (0, len(key_index) - len(totals))) + chunk_totals
+        increments = {key: float(totals[idx]) for key, idx in key_index.items()}
+        return increments, last_row_id, processed
+
+    def run(self, now: Optional[float] = None) -> int:
+        """执行一次增量重算，返回本次处理的 play_history 行数；now 缺省为当前时间"""
+        if now is None:
+            now = time.time()
+        try:
+            # 扫描使用只读连接，不占用写锁
+            with self.db_pool.reader() as conn:
+                cursor = conn.cursor()
+                start_row_id, last_run_at = self._read_watermark(cursor)
+                increments, end_row_id, processed = self._accumulate(cursor, start_row_id, now)
+
+            with self.db_pool.writer() as conn:
+                cursor = conn.cursor()
+                # 乐观并发：其他 worker 已重算过（即使没有新记录也会更新 last_run_at）则放弃本次结果，
+                # 否则已有分数会按旧的 last_run_at 被重复衰减
+                if self._read_watermark(cursor) != (start_row_id, last_run_at):
+                    self.logger.info("热度水位线已被其他进程更新，跳过本次重算")
+                    return 0
+                self._write_back(cursor, increments, last_run_at, end_row_id, now)
+
+            self.logger.info(f"热度重算完成，新增记录 {processed} 条，水位线 {end_row_id}")
+            return processed
+        except Exception as e:
+            self.logger.error(f"热度重算失败: {e}")
+            raise
+
+    def _write_back(self, cursor, increments: Dict[Tuple[str, str], float],
+                    last_run_at: Optional[float], end_row_id: int, now: float):
+        """已有分数衰减到 now、累加增量并推进水位线（在调用方的写事务内执行）"""
+        if last_run_at is not None:
+            cursor.execute(
+                'UPDATE song_popularity SET score = score * ?, updated_at = ?',
+                (math.exp(-self.decay_rate * max(0.0, now - last_run_at)), now)
+            )
+        cursor.executemany('''
+            INSERT INTO song_popularity (song_id, emotion, score, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(song_id, emotion) DO UPDATE SET
+                score = score + excluded.score,
+                updated_at = excluded.updated_at
+        ''', [(song_id, emotion, score, now) for (song_id, emotion), score in increments.items()])
+        cursor.execute('''
+            INSERT OR REPLACE INTO popularity_watermark (job, last_row_id, last_run_at)
+            VALUES (?, ?, ?)
+        ''', (self.JOB_NAME, end_row_id, now))
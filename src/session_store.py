@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from db_pool import SQLitePool
+
+
+class SessionRecord:
+    """紧凑的会话记录，使用 __slots__ 避免每个连接一个 dict 的开销"""
+    __slots__ = ('user_id', 'current_emotion', 'current_song', 'connected_at', 'last_seen')
+
+    def __init__(self, user_id: Optional[str] = None, current_emotion: Optional[str] = None,
+                 current_song: Optional[str] = None, connected_at: Optional[float] = None,
+                 last_seen: Optional[float] = None):
+        now = time.time()
+        self.user_id = user_id
+        self.current_emotion = current_emotion
+        self.current_song = current_song
+        self.connected_at = connected_at if connected_at is not None else now
+        self.last_seen = last_seen if last_seen is not None else now
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SessionStore(ABC):
+    """会话存储抽象，所有 Socket.IO 事件处理都只通过该接口读写会话状态
+
+    容量上限 max_sessions 超出时淘汰最久未活动的会话；空闲超过 idle_ttl 秒的会话由 sweep() 清理。
+    get/update 都会刷新会话的最近活动时间。
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._evicted = 0
+        self._peak = 0
+        self._stats_lock = threading.Lock()
+
+    def _record_evictions(self, count: int) -> None:
+        if count:
+            with self._stats_lock:
+                self._evicted += count
+
+    def _record_live(self, live: int) -> None:
+        with self._stats_lock:
+            self._peak = max(self._peak, live)
+
+    @abstractmethod
+    def create(self, session_id: str, record: Dict) -> None:
+        """创建（或覆盖）会话"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """读取会话并刷新最近活动时间，会话不存在时返回 None"""
+
+    @abstractmethod
+    def update(self, session_id: str, **fields) -> bool:
+        """更新已存在会话的部分字段，会话不存在时返回 False"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """清理空闲超时的会话，返回清理数量"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """当前存活会话数量"""
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def stats(self) -> Dict:
+        """会话指标：当前存活、累计淘汰与峰值数量（淘汰与峰值为本进程视角）"""
+        live = len(self)
+        with self._stats_lock:
+            evicted, peak = self._evicted, self._peak
+        return {
+            'live': live,
+            'evicted': evicted,
+            'peak': peak,
+            'capacity': self.max_sessions,
+            'idle_ttl': self.idle_ttl
+        }
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内会话存储，仅适用于单进程部署（开发环境默认）"""
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 1800.0):
+        super().__init__(max_sessions, idle_ttl)
+        # 按最近活动时间排序，队首即最久未活动的会话
+        self._sessions: 'OrderedDict[str, SessionRecord]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, record: Dict) -> None:
+        with self._lock:
+            self._sessions[session_id] = SessionRecord(**record)
+            self._sessions.move_to_end(session_id)
+            evicted = 0
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                evicted += 1
+            live = len(self._sessions)
+        self._record_evictions(evicted)
+        self._record_live(live)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            record.last_seen = time.time()
+            self._sessions.move_to_end(session_id)
+            return record.to_dict()
+
+    def update(self, session_id: str, **fields) -> bool:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return False
+            for name, value in fields.items():
+                setattr(record, name, value)
+            record.last_seen = time.time()
+            self._sessions.move_to_end(session_id)
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def sweep(self) -> int:
+        deadline = time.time() - self.idle_ttl
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                session_id, record = next(iter(self._sessions.items()))
+                if record.last_seen >= deadline:
+                    break
+                del self._sessions[session_id]
+                removed += 1
+        self._record_evictions(removed)
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于 SQLite(WAL) 的共享会话存储，同一主机上的所有 gunicorn worker 共用一个库文件
+
+    读写都经由 SQLitePool：查询借用只读连接，写入走唯一的写连接，不再为每个事件线程新开连接。
+    """
+
+    def __init__(self, db_path: str, max_sessions: int = 10000, idle_ttl: float = 1800.0):
+        super().__init__(max_sessions, idle_ttl)
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path
+        self.db_pool = SQLitePool.from_env(db_path)
+        self.init_database()
+
+    def init_database(self):
+        """初始化会话表"""
+        try:
+            with self.db_pool.writer() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        session_id TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)')
+        except Exception as e:
+            self.logger.error(f"会话库初始化失败: {e}")
+            raise
+
+    def create(self, session_id: str, record: Dict) -> None:
+        record = SessionRecord(**record)
+        with self.db_pool.writer() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)',
+                (session_id, json.dumps(record.to_dict()), record.last_seen)
+            )
+            live = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            evicted = 0
+            if live > self.max_sessions:
+                # 超出容量时淘汰最久未活动的会话
+                evicted = conn.execute('''
+                    DELETE FROM sessions WHERE session_id IN (
+                        SELECT session_id FROM sessions ORDER BY updated_at ASC LIMIT ?
+                    )
+                ''', (live - self.max_sessions,)).rowcount
+                live -= evicted
+        self._record_evictions(evicted)
+        self._record_live(live)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        # 与内存实现一致：读取也算一次活动，刷新 updated_at，避免刚被读取的会话被淘汰
+        now = time.time()
+        with self.db_pool.writer() as conn:
+            row = conn.execute(
+                'SELECT data FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            record['last_seen'] = now
+            conn.execute(
+                'UPDATE sessions SET data = ?, updated_at = ? WHERE session_id = ?',
+                (json.dumps(record), now, session_id)
+            )
+        return record
+
+    def update(self, session_id: str, **fields) -> bool:
+        # 写连接的事务以 BEGIN IMMEDIATE 开始，多个 worker 读-改-写时不会互相覆盖
+        with self.db_pool.writer() as conn:
+            row = conn.execute(
+                'SELECT data FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            record = json.loads(row[0])
+            record.update(fields)
+            record['last_seen'] = time.time()
+            conn.execute(
+                'UPDATE sessions SET data = ?, updated_at = ? WHERE session_id = ?',
+                (json.dumps(record), record['last_seen'], session_id)
+            )
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        with self.db_pool.writer() as conn:
+            return conn.execute(
+                'DELETE FROM sessions WHERE session_id = ?', (session_id,)
+            ).rowcount > 0
+
+    def sweep(self) -> int:
+        with self.db_pool.writer() as conn:
+            removed = conn.execute(
+                'DELETE FROM sessions WHERE updated_at < ?', (time.time() - self.idle_ttl,)
+            ).rowcount
+        self._record_evictions(removed)
+        return removed
+
+    def __len__(self) -> int:
+        with self.db_pool.reader() as conn:
+            return conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def close(self) -> None:
+        """关闭连接池中的所有连接"""
+        try:
+            self.db_pool.close()
+        except Exception as e:
+            self.logger.error(f"关闭会话库连接失败: {e}")
+
+
+def create_session_store(backend: Optional[str] = None, db_path: Optional[str] = None) -> SessionStore:
+    """按环境变量创建会话存储
+
+    SESSION_STORE(memory|sqlite)、SESSION_DB_PATH、SESSION_MAX(容量上限)、SESSION_IDLE_TTL(空闲秒数)
+    """
+    backend = (backend or os.environ.get('SESSION_STORE', 'memory')).lower()
+    max_sessions = int(os.environ.get('SESSION_MAX', 10000))
+    idle_ttl = float(os.environ.get('SESSION_IDLE_TTL', 1800))
+    if backend == 'memory':
+        return MemorySessionStore(max_sessions, idle_ttl)
+    if backend == 'sqlite':
+        if not db_path:
+            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            db_path = os.environ.get('SESSION_DB_PATH') or os.path.join(project_root, 'sessions.db')
+        return SQLiteSessionStore(db_path, max_sessions, idle_ttl)
+    raise ValueError(f"未知的会话存储类型: {backend}")
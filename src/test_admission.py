@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+测试情绪识别准入控制
+"""
+
+import time
+
+from admission import (
+    AdmissionController, AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+)
+
+
+def expect_rejected(controller, status, **kwargs):
+    try:
+        with controller.admit(**kwargs):
+            pass
+    except AdmissionRejected as e:
+        assert e.status == status, (e.status, status)
+        return e
+    raise AssertionError(f'应被拒绝，期望状态码 {status}')
+
+
+def test_busy_rejection_does_not_consume_token():
+    controller = AdmissionController(max_inflight=1, interactive_reserve=0, user_rate=0.01,
+                                     user_burst=1, interactive_wait_ms=0)
+    with controller.admit('other'):
+        e = expect_rejected(controller, 503, user_id='u-1')
+        assert e.retry_after == 1
+    # 按 Retry-After 重试时名额已空出，令牌未被 503 消耗，应被正常服务
+    with controller.admit('u-1'):
+        pass
+    # 令牌此时才被用完
+    expect_rejected(controller, 429, user_id='u-1')
+    stats = controller.stats()
+    assert stats['admitted'] == 2 and stats['rejected_busy'] == 1 and stats['rejected_rate'] == 1
+    assert stats['inflight'] == 0
+
+
+def test_rate_limit_retry_after():
+    controller = AdmissionController(user_rate=0.5, user_burst=2)
+    for _ in range(2):
+        with controller.admit('u-1'):
+            pass
+    e = expect_rejected(controller, 429, user_id='u-1')
+    assert e.retry_after == 2
+
+
+def test_background_leaves_interactive_reserve():
+    controller = AdmissionController(max_inflight=2, interactive_reserve=1, interactive_wait_ms=0)
+    with controller.admit(priority=PRIORITY_BACKGROUND):
+        expect_rejected(controller, 503, priority=PRIORITY_BACKGROUND)
+        with controller.admit(priority=PRIORITY_INTERACTIVE):
+            pass
+
+
+def test_freshness_uses_server_clock():
+    controller = AdmissionController(max_frame_age_ms=1000)
+    # 客户端只上报相对年龄，与两端时钟是否一致无关
+    with controller.admit(frame_age_ms=200):
+        pass
+    expect_rejected(controller, 408, frame_age_ms=1500)
+    # 服务端收到请求后已过去 0.9s，加上 200ms 的客户端年龄同样超龄
+    expect_rejected(controller, 408, frame_age_ms=200, received_at=time.monotonic() - 0.9)
+
+
+def test_invalid_user_rate():
+    try:
+        AdmissionController(user_rate=0)
+    except ValueError:
+        return
+    raise AssertionError('user_rate=0 应被拒绝')
+
+
+if __name__ == '__main__':
+    test_busy_rejection_does_not_consume_token()
+    test_rate_limit_retry_after()
+    test_background_leaves_interactive_reserve()
+    test_freshness_uses_server_clock()
+    test_invalid_user_rate()
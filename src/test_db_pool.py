@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试 SQLite 连接池：只读连接上限与等待超时、query_only、写事务回滚
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from db_pool import SQLitePool, PoolTimeout
+
+
+def make_pool(**kwargs):
+    db_path = os.path.join(tempfile.mkdtemp(), 'pool.db')
+    pool = SQLitePool(db_path, **kwargs)
+    with pool.writer() as conn:
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+    return pool
+
+
+def test_readers_are_bounded_and_time_out():
+    pool = make_pool(max_readers=2, timeout=0.1)
+    with pool.reader() as first, pool.reader() as second:
+        assert first is not second
+        try:
+            with pool.reader():
+                pass
+        except PoolTimeout:
+            pass
+        else:
+            raise AssertionError('只读连接耗尽时应等待超时')
+    stats = pool.stats()
+    assert stats['readers_open'] == 2 and stats['readers_idle'] == 2
+    assert stats['reader_waits'] == 1 and stats['reader_timeouts'] == 1
+    # 归还后的连接被复用，不会新建
+    with pool.reader():
+        pass
+    assert pool.stats()['readers_open'] == 2
+    pool.close()
+
+
+def test_reader_rejects_writes():
+    pool = make_pool()
+    with pool.reader() as conn:
+        try:
+            conn.execute("INSERT INTO items (name) VALUES ('x')")
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError('query_only 连接应拒绝写入')
+    with pool.reader() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+    pool.close()
+
+
+def test_writer_rolls_back_on_error():
+    pool = make_pool()
+    try:
+        with pool.writer() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('x')")
+            raise ValueError('boom')
+    except ValueError:
+        pass
+    with pool.reader() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+    # 回滚后写连接仍可继续使用
+    with pool.writer() as conn:
+        conn.execute("INSERT INTO items (name) VALUES ('y')")
+    with pool.reader() as conn:
+        assert conn.execute('SELECT name FROM items').fetchall() == [('y',)]
+    assert pool.stats()['writer_rollbacks'] == 1
+    pool.close()
+
+
+def test_statement_cache_from_env():
+    os.environ['DB_POOL_STMT_CACHE'] = '32'
+    try:
+        pool = SQLitePool.from_env(os.path.join(tempfile.mkdtemp(), 'pool.db'))
+    finally:
+        del os.environ['DB_POOL_STMT_CACHE']
+    assert pool.stats()['cached_statements'] == 32
+    pool.close()
+
+
+def test_close_rejects_further_use():
+    pool = make_pool()
+    pool.close()
+    for open_conn in (pool.reader, pool.writer):
+        try:
+            with open_conn():
+                pass
+        except RuntimeError:
+            continue
+        raise AssertionError('连接池关闭后不应再借出连接')
+    assert pool.stats()['closed'] and pool.stats()['readers_open'] == 0
+
+
+def test_reader_returned_after_close_is_closed():
+    pool = make_pool()
+    with pool.reader() as conn:
+        pool.close()
+    # 借出期间连接池被关闭：归还时直接关闭连接，不会留在空闲队列里
+    assert pool.stats()['readers_idle'] == 0
+    try:
+        conn.execute('SELECT 1')
+    except sqlite3.ProgrammingError:
+        pass
+    else:
+        raise AssertionError('连接池关闭后归还的连接应被关闭')
+
+
+if __name__ == '__main__':
+    test_readers_are_bounded_and_time_out()
+    test_reader_rejects_writes()
+    test_writer_rolls_back_on_error()
+    test_statement_cache_from_env()
+    test_close_rejects_further_use()
+    test_reader_returned_after_close_is_closed()
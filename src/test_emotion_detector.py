@@ -6,7 +6,7 @@
 import cv2
 import numpy as np
 import os
-from emotion_detector import EmotionDetector
+from emotion_detector import EmotionDetector, FACE_INPUT_SIZE, parse_face_crops
 
 def test_emotion_detector():
     detector = EmotionDetector()
@@ -15,5 +15,124 @@ def test_emotion_detector():
     print('主要情绪:', emotion, '置信度:', confidence)
     print('所有情绪概率:', all_emotions)
 
+class StubClassifier:
+    """替代 FER 的分类阶段：记录送入的批次并按顺序返回固定概率"""
+
+    def __init__(self, predictions, input_shape=(None, 64, 64, 1)):
+        self.predictions = predictions
+        self.batch = None
+        self._FER__emotion_classifier = type('Model', (), {'input_shape': input_shape})()
+
+    def _classify_emotions(self, batch):
+        self.batch = batch
+        return self.predictions
+
+def test_classify_faces():
+    detector = EmotionDetector()
+    # 标签顺序: angry, disgust, fear, happy, sad, surprise, neutral
+    detector.detector = StubClassifier([
+        [0.0, 0.0, 0.0, 0.9, 0.0, 0.0, 0.1],
+        [0.0, 0.0, 0.0, 0.0, 0.6, 0.0, 0.4],
+    ])
+    faces = np.zeros((2, 64, 64), dtype=np.uint8)
+    faces[1] = 255
+    emotion, confidence, all_emotions, per_face = detector.classify_face_batch(faces)
+
+    # 预处理与 FER 一致：(N, 64, 64, 1)，像素缩放到 [-1, 1]
+    assert detector.detector.batch.shape == (2, 64, 64, 1)
+    assert detector.detector.batch[0].max() == -1.0 and detector.detector.batch[1].min() == 1.0
+
+    # 逐张结果与群体模式同构（无人脸框）
+    assert [face['emotion'] for face in per_face] == ['happy', 'sad']
+    assert [face['confidence'] for face in per_face] == [0.9, 0.6]
+    assert set(per_face[0]) == {'emotion', 'confidence', 'all_emotions'}
+    assert set(per_face[0]['all_emotions']) == set(detector.get_all_emotions())
+
+    # 置信度加权：happy 0.9*0.9/1.5，sad 0.6*0.6/1.5，neutral (0.9*0.1+0.6*0.4)/1.5
+    assert all_emotions['happy'] == 0.54
+    assert all_emotions['sad'] == 0.24
+    assert all_emotions['neutral'] == 0.22
+    assert emotion == 'happy' and confidence == 0.54
+    print('人脸裁剪主要情绪:', emotion, '置信度:', confidence)
+
+def test_parse_face_crops():
+    face_bytes = FACE_INPUT_SIZE[0] * FACE_INPUT_SIZE[1]
+    crops = parse_face_crops(bytes(range(256)) * (2 * face_bytes // 256), max_faces=16)
+    assert crops.shape == (2, 64, 64) and crops.dtype == np.uint8
+    assert crops[0, 0, :4].tolist() == [0, 1, 2, 3]
+    assert parse_face_crops(bytes(16 * face_bytes), max_faces=16).shape == (16, 64, 64)
+    # 以下情况接口返回 400
+    assert parse_face_crops(b'', max_faces=16) is None
+    assert parse_face_crops(None, max_faces=16) is None
+    assert parse_face_crops('x' * face_bytes, max_faces=16) is None
+    assert parse_face_crops(bytes(face_bytes - 1), max_faces=16) is None
+    assert parse_face_crops(bytes(face_bytes + 1), max_faces=16) is None
+    assert parse_face_crops(bytes(17 * face_bytes), max_faces=16) is None
+
+def test_check_face_input_size():
+    detector = EmotionDetector()
+    detector.detector = StubClassifier([], input_shape=(None, 64, 64, 1))
+    detector.check_face_input_size()
+    detector.detector = StubClassifier([], input_shape=(None, 48, 48, 1))
+    try:
+        detector.check_face_input_size()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('分类器输入尺寸与 FACE_INPUT_SIZE 不一致时应报错')
+    # 找不到分类器时只告警，不影响启动
+    detector.detector = object()
+    detector.check_face_input_size()
+
+class StubFER:
+    """替代 FER：返回固定的人脸框与表情概率，并记录送去分类的人脸框"""
+
+    def __init__(self, faces):
+        self.faces = faces
+        self.classified_boxes = None
+
+    def find_faces(self, frame):
+        return [box for box, _ in self.faces]
+
+    def detect_emotions(self, frame, face_rectangles=None):
+        self.classified_boxes = [tuple(box) for box in face_rectangles]
+        emotions_by_box = {tuple(box): emotions for box, emotions in self.faces}
+        return [{'box': box, 'emotions': emotions_by_box[tuple(box)]} for box in face_rectangles]
+
+def test_detect_group_emotion():
+    detector = EmotionDetector()
+    detector.detector = StubFER([
+        ((300, 40, 50, 50), {'sad': 0.6, 'neutral': 0.4}),
+        ((0, 0, 10, 10), {'angry': 1.0}),
+        ((10, 20, 100, 100), {'happy': 0.8, 'neutral': 0.2}),
+    ])
+    img = np.ones((480, 640, 3), dtype=np.uint8) * 128
+    emotion, confidence, group_emotions, faces = detector.detect_group_emotion(img, max_faces=2)
+
+    # 只保留面积最大的两张脸，且一次性送去分类
+    assert detector.detector.classified_boxes == [(10, 20, 100, 100), (300, 40, 50, 50)]
+    assert [face['box'] for face in faces] == [[10, 20, 100, 100], [300, 40, 50, 50]]
+    assert [face['emotion'] for face in faces] == ['happy', 'sad']
+    assert [face['confidence'] for face in faces] == [0.8, 0.6]
+
+    # 置信度加权：happy 0.8*0.8/1.4，sad 0.6*0.6/1.4，neutral (0.8*0.2+0.6*0.4)/1.4
+    assert group_emotions['happy'] == 0.46
+    assert group_emotions['sad'] == 0.26
+    assert group_emotions['neutral'] == 0.29
+    assert group_emotions['angry'] == 0.0
+    assert emotion == 'happy' and confidence == 0.46
+    print('群体情绪:', emotion, '置信度:', confidence, '人脸数:', len(faces))
+
+def test_detect_group_emotion_without_faces():
+    detector = EmotionDetector()
+    detector.detector = StubFER([])
+    img = np.ones((480, 640, 3), dtype=np.uint8) * 128
+    assert detector.detect_group_emotion(img) == ('neutral', 0.0, {'neutral': 1.0}, [])
+
 if __name__ == '__main__':
     test_emotion_detector()
+    test_classify_faces()
+    test_parse_face_crops()
+    test_check_face_input_size()
+    test_detect_group_emotion()
+    test_detect_group_emotion_without_faces()
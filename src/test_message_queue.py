@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试多 worker 部署时 Socket.IO 事件经消息队列（SOCKETIO_MESSAGE_QUEUE）广播到其他 worker
+
+需要可连接的队列，例如本机 redis：
+    SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6379/0 python test_message_queue.py
+队列不可用时跳过。
+"""
+
+import os
+import time
+import socket
+import threading
+
+import socketio
+from flask import Flask
+from flask_socketio import SocketIO
+
+QUEUE_URL = os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'redis://127.0.0.1:6379/0')
+
+
+def queue_available():
+    try:
+        import redis
+        return redis.Redis.from_url(QUEUE_URL, socket_connect_timeout=1).ping()
+    except Exception:
+        return False
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_worker(port):
+    """worker A：与 app.py 配置一致、挂在消息队列上的 Socket.IO 服务"""
+    app = Flask(__name__)
+    worker = SocketIO(app, async_mode='threading', message_queue=QUEUE_URL)
+    threading.Thread(
+        target=worker.run, args=(app,),
+        kwargs={'host': '127.0.0.1', 'port': port, 'allow_unsafe_werkzeug': True},
+        daemon=True
+    ).start()
+    return worker
+
+
+def connect_client(url, timeout=5.0):
+    deadline = time.time() + timeout
+    while True:
+        client = socketio.SimpleClient()
+        try:
+            client.connect(url, transports=['polling'])
+            return client
+        except socketio.exceptions.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_emit_reaches_other_worker():
+    if not queue_available():
+        print(f'消息队列 {QUEUE_URL} 不可用，跳过')
+        return
+
+    port = free_port()
+    start_worker(port)
+    client = connect_client(f'http://127.0.0.1:{port}')
+
+    # worker B：另一个进程里的 SocketIO 实例，只通过消息队列发送事件
+    worker_b = SocketIO(message_queue=QUEUE_URL)
+
+    # worker A 的订阅线程是异步启动的，订阅就绪前发出的消息会丢失，因此重发直到收到
+    received = None
+    deadline = time.time() + 5
+    try:
+        while received is None and time.time() < deadline:
+            worker_b.emit('emotion_detected', {'emotion': 'happy'})
+            try:
+                received = client.receive(timeout=0.5)
+            except socketio.exceptions.TimeoutError:
+                pass
+    finally:
+        client.disconnect()
+
+    assert received == ['emotion_detected', {'emotion': 'happy'}], \
+        'worker B 发出的事件未经消息队列到达 worker A 的客户端'
+
+
+if __name__ == '__main__':
+    test_emit_reaches_other_worker()
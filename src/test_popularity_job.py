@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试时间衰减热度重算任务
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+
+from db_pool import SQLitePool
+from popularity_job import PopularityJob
+
+DAY = 86400
+NOW = 1700000000.0
+
+
+def make_db(time_column='timestamp'):
+    db_path = os.path.join(tempfile.mkdtemp(), 'music.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute(f'''
+        CREATE TABLE play_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            song_id TEXT,
+            emotion TEXT,
+            rating INTEGER,
+            {time_column} DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE song_popularity (
+            song_id TEXT,
+            emotion TEXT,
+            score REAL DEFAULT 0.0,
+            updated_at REAL,
+            PRIMARY KEY (song_id, emotion)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE popularity_watermark (
+            job TEXT PRIMARY KEY,
+            last_row_id INTEGER DEFAULT 0,
+            last_run_at REAL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def add_plays(db_path, rows, time_column='timestamp'):
+    """rows: (song_id, emotion, rating, 播放时间戳)"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        f'INSERT INTO play_history (user_id, song_id, emotion, rating, {time_column}) VALUES (?, ?, ?, ?, ?)',
+        [('u-1', song_id, emotion, rating, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)))
+         for song_id, emotion, rating, ts in rows]
+    )
+    conn.commit()
+    conn.close()
+
+
+def read_scores(db_path):
+    conn = sqlite3.connect(db_path)
+    scores = {(row[0], row[1]): row[2] for row in conn.execute('SELECT song_id, emotion, score FROM song_popularity')}
+    watermark = conn.execute('SELECT last_row_id, last_run_at FROM popularity_watermark').fetchone()
+    conn.close()
+    return scores, watermark
+
+
+def assert_scores(actual, expected):
+    assert set(actual) == set(expected), (actual, expected)
+    for key, value in expected.items():
+        assert abs(actual[key] - value) < 1e-6, (key, actual[key], value)
+
+
+def test_incremental_decay_with_legacy_played_at():
+    db_path = make_db('played_at')
+    add_plays(db_path, [
+        ('a', 'happy', 4, NOW),
+        ('a', 'happy', 2, NOW - DAY),
+        ('a', 'happy', None, NOW - 2 * DAY),  # 无评分播放按 play_weight=1 计
+        ('c', None, 5, NOW),                  # 缺少情绪的记录被忽略
+        ('b', 'sad', 5, NOW),
+    ], 'played_at')
+    pool = SQLitePool(db_path)
+    # 分块小于记录数，覆盖跨分块累加
+    job = PopularityJob(pool, half_life_days=1, chunk_size=2)
+
+    assert job.run(now=NOW) == 4
+    scores, watermark = read_scores(db_path)
+    assert_scores(scores, {('a', 'happy'): 4 + 1 + 0.25, ('b', 'sad'): 5})
+    assert watermark == (5, NOW)
+
+    # 一个半衰期后再跑：旧分数减半，只累加水位线之后的新记录
+    add_plays(db_path, [
+        ('a', 'happy', 3, NOW + DAY),
+        ('b', 'happy', 2, NOW),
+    ], 'played_at')
+    assert job.run(now=NOW + DAY) == 2
+    scores, watermark = read_scores(db_path)
+    assert_scores(scores, {('a', 'happy'): 5.25 / 2 + 3, ('b', 'sad'): 2.5, ('b', 'happy'): 1})
+    assert watermark == (7, NOW + DAY)
+
+    # 没有新记录时只做整体衰减
+    assert job.run(now=NOW + 2 * DAY) == 0
+    scores, _ = read_scores(db_path)
+    assert_scores(scores, {('a', 'happy'): 5.625 / 2, ('b', 'sad'): 1.25, ('b', 'happy'): 0.5})
+    pool.close()
+
+
+def test_timestamp_column():
+    db_path = make_db('timestamp')
+    add_plays(db_path, [('a', 'happy', 4, NOW - DAY)])
+    pool = SQLitePool(db_path)
+    assert PopularityJob(pool, half_life_days=1).run(now=NOW) == 1
+    scores, _ = read_scores(db_path)
+    assert_scores(scores, {('a', 'happy'): 2})
+    pool.close()
+
+
+class InterleavedJob(PopularityJob):
+    """扫描完成后、写回之前先让另一个 worker 的任务跑完，模拟多 worker 并发重算"""
+
+    def __init__(self, db_pool, other, **kwargs):
+        super().__init__(db_pool, **kwargs)
+        self.other = other
+
+    def _accumulate(self, cursor, last_row_id, now):
+        result = super()._accumulate(cursor, last_row_id, now)
+        self.other.run(now=now)
+        return result
+
+
+def test_concurrent_runs_decay_once():
+    db_path = make_db('timestamp')
+    add_plays(db_path, [('a', 'happy', 4, NOW)])
+    pool = SQLitePool(db_path)
+    other = PopularityJob(pool, half_life_days=1)
+    assert other.run(now=NOW) == 1
+
+    # 两个 worker 在同一个安静的周期内都没有读到新记录，已有分数只能衰减一次
+    job = InterleavedJob(pool, other, half_life_days=1)
+    assert job.run(now=NOW + DAY) == 0
+    scores, watermark = read_scores(db_path)
+    assert_scores(scores, {('a', 'happy'): 2})
+    assert watermark == (1, NOW + DAY)
+    pool.close()
+
+
+if __name__ == '__main__':
+    test_incremental_decay_with_legacy_played_at()
+    test_timestamp_column()
+    test_concurrent_runs_decay_once()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试会话存储（内存与 SQLite 两种实现行为一致）
+"""
+
+import os
+import time
+import tempfile
+
+from session_store import SessionStore, MemorySessionStore, SQLiteSessionStore
+
+
+def make_stores(max_sessions=3, idle_ttl=1800.0):
+    db_path = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+    return [
+        MemorySessionStore(max_sessions, idle_ttl),
+        SQLiteSessionStore(db_path, max_sessions, idle_ttl)
+    ]
+
+
+def test_abstract_store_cannot_be_instantiated():
+    try:
+        SessionStore()
+    except TypeError:
+        return
+    raise AssertionError('SessionStore 应为抽象类')
+
+
+def test_crud():
+    for store in make_stores():
+        store.create('a', {'user_id': None})
+        assert store.update('a', user_id='u-1')
+        assert not store.update('missing', user_id='u-1')
+        assert store.get('a')['user_id'] == 'u-1'
+        assert 'a' in store and len(store) == 1
+        assert store.delete('a') and not store.delete('a')
+        assert len(store) == 0
+        store.close()
+
+
+def test_read_refreshes_lru_order():
+    for store in make_stores(max_sessions=3):
+        for session_id in ('s0', 's1', 's2'):
+            store.create(session_id, {})
+            time.sleep(0.01)
+        # 读取 s0 后，容量淘汰应选中最久未活动的 s1
+        assert store.get('s0') is not None
+        time.sleep(0.01)
+        store.create('s3', {})
+        assert 's0' in store, type(store).__name__
+        assert 's1' not in store, type(store).__name__
+        stats = store.stats()
+        assert stats['live'] == 3 and stats['evicted'] == 1 and stats['peak'] == 3
+        store.close()
+
+
+def test_read_refreshes_idle_ttl():
+    for store in make_stores(idle_ttl=0.2):
+        store.create('read', {})
+        store.create('idle', {})
+        time.sleep(0.15)
+        store.get('read')
+        time.sleep(0.1)
+        assert store.sweep() == 1, type(store).__name__
+        assert 'read' in store and 'idle' not in store
+        store.close()
+
+
+if __name__ == '__main__':
+    test_abstract_store_cannot_be_instantiated()
+    test_crud()
+    test_read_refreshes_lru_order()
+    test_read_refreshes_idle_ttl()